@@ -1,15 +1,22 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import sqlite3
 from pathlib import Path
 from datetime import datetime, date, timedelta
-import uuid
+import functools
+import collections
+import threading
+import queue
+import atexit
+from contextlib import contextmanager, closing
+import time
 import hashlib
 import json
+import random
 import io
+import codecs
+from concurrent.futures import ThreadPoolExecutor
 import base64
 import numpy as np
 
@@ -131,59 +138,198 @@ DB_PATH = Path("smd_intelligence_hub.db")
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Connection tuning: WAL lets readers overlap the writer and, with
+# synchronous=NORMAL, drops the per-commit fsync. page_size only applies to a
+# brand-new file, so it must come before journal_mode; existing DBs keep theirs
+SQLITE_PRAGMAS = (
+    "PRAGMA page_size=8192",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-131072",
+    "PRAGMA mmap_size=2147483648",
+    "PRAGMA busy_timeout=5000",
+)
+# Read-only connections shared by all sessions (the writer is separate)
+READ_POOL_SIZE = 4
+# Seconds to wait for a pooled reader before opening a one-off connection
+READ_POOL_TIMEOUT = 2
+
+# Upper bounds on series/bars sent to the browser for a single chart
+MAX_TREND_SERIES = 20
+MAX_BAR_CATEGORIES = 25
+# Rows shipped to the browser for a raw table view (exports keep everything)
+MAX_TABLE_ROWS = 1_000
+
+# Static widget options, built once at import instead of on every rerun
+CATEGORY_TYPES = ("Business", "Geographic", "Temporal", "Product", "Customer", "Other")
+CATEGORY_ICONS = ("📁", "🏷️", "📊", "🌍", "👥", "📦", "💰", "📅", "🎯", "⭐")
+AGG_FUNCS = ("sum", "mean", "count", "min", "max")
+TIME_GRANULARITIES = ("Day", "Week", "Month", "Quarter")
+REPORT_TYPES = ("KPI Scorecard", "Department Performance", "All Data")
+USER_ROLES = ("Admin", "Executive", "DeptHead", "Staff")
+
+# Rows fetched per chunk when streaming large workspace tables
+READ_CHUNK_ROWS = 10_000
+# Rows serialized/inserted per batch when saving an import
+IMPORT_CHUNK_ROWS = 5_000
+
+# Slices/filters share memory until written to; always on (and the option
+# deprecated) from pandas 3.0, so only opt in on older versions
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # ============================================================
 # DATABASE HELPERS
 # ============================================================
+def open_conn():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@st.cache_resource
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    # The single writer connection per server process; only used under write_txn
+    return open_conn()
 
-def exec_sql(sql, params=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute(sql, params or ())
-        conn.commit()
-    finally:
-        conn.close()
+@st.cache_resource
+def get_read_pool():
+    # Readers get their own connections so WAL gives them a committed snapshot
+    # instead of seeing another session's open write transaction
+    pool = queue.SimpleQueue()
+    for _ in range(READ_POOL_SIZE):
+        pool.put(open_read_conn())
+    return pool
 
-def read_df(sql, params=None):
-    conn = get_conn()
-    try:
-        return pd.read_sql_query(sql, conn, params=params) if params else pd.read_sql_query(sql, conn)
-    finally:
-        conn.close()
+def open_read_conn():
+    conn = open_conn()
+    conn.execute("PRAGMA query_only=ON")
+    return conn
 
-def replace_table(table, df):
-    conn = get_conn()
+@contextmanager
+def read_conn():
+    """Borrow a read-only connection from the pool for the duration of a query"""
+    pool = get_read_pool()
+    try:
+        conn, pooled = pool.get(timeout=READ_POOL_TIMEOUT), True
+    except queue.Empty:
+        # Pool exhausted (many concurrent readers): use a one-off connection
+        # rather than blocking this session
+        conn, pooled = open_read_conn(), False
     try:
-        df.to_sql(table, conn, if_exists="replace", index=False)
+        yield conn
     finally:
-        conn.close()
+        if pooled:
+            pool.put(conn)
+        else:
+            conn.close()
+
+@st.cache_resource
+def get_write_lock():
+    # Sessions run on their own threads but share the writer; a transaction
+    # on the shared connection must not interleave with another session's
+    return threading.RLock()
 
-def append_table(table, df):
+@contextmanager
+def write_txn():
+    """Serialized write transaction on the shared connection (commit/rollback on exit)"""
     conn = get_conn()
-    try:
-        df.to_sql(table, conn, if_exists="append", index=False)
-    finally:
-        conn.close()
+    with get_write_lock(), conn:
+        yield conn
+
+def exec_sql(sql, params=None):
+    with write_txn() as conn:
+        conn.execute(sql, params or ())
+
+def exec_many_sql(statements):
+    # Run several (sql, params) statements as one transaction
+    with write_txn() as conn:
+        for sql, params in statements:
+            conn.execute(sql, params or ())
+
+def read_df(sql, params=None, chunksize=None):
+    # Build frames straight from cursor tuples (skips pandas' SQL layer);
+    # with chunksize, returns an iterator of DataFrames fed by fetchmany
+    if chunksize:
+        return read_df_chunks(sql, params, chunksize)
+    with read_conn() as conn:
+        cur = conn.execute(sql, params or ())
+        columns = [col[0] for col in cur.description]
+        return pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+
+def read_df_chunks(sql, params, chunksize):
+    # Holds its connection until exhausted or closed; consume it inside
+    # contextlib.closing() so an early exit returns the connection right away
+    with read_conn() as conn:
+        cur = conn.execute(sql, params or ())
+        try:
+            columns = [col[0] for col in cur.description]
+            for rows in iter(lambda: cur.fetchmany(chunksize), []):
+                yield pd.DataFrame.from_records(rows, columns=columns)
+        finally:
+            cur.close()
+
+def fetch_rows(sql, params=None):
+    # Small result sets consumed by loops/widgets: plain dicts, no DataFrame
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        return [dict(row) for row in cur.execute(sql, params or ())]
+
+@functools.lru_cache(maxsize=None)
+def insert_sql(table, columns):
+    # Built once per (table, columns); identical text also reuses sqlite3's statement cache
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
 
-def uid(prefix=""):
-    return f"{prefix}_{uuid.uuid4().hex[:10]}" if prefix else uuid.uuid4().hex[:12]
+def insert_rows(conn, table, columns, rows):
+    # One executemany over plain tuples; caller owns the transaction
+    conn.executemany(insert_sql(table, tuple(columns)), rows)
+
+def insert_df_rows(conn, table, df):
+    insert_rows(conn, table, df.columns, df.itertuples(index=False, name=None))
+
+def replace_tables(tables):
+    # DELETE + one executemany per table, all in a single transaction: keeps
+    # the schema (PKs/defaults from init_db) and commits/fsyncs once
+    with write_txn() as conn:
+        for table, df in tables.items():
+            conn.execute(f"DELETE FROM {table}")
+            insert_df_rows(conn, table, df)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_departments():
+    """Department ids/names/colors for dashboards and dropdowns (cached)"""
+    return read_df("SELECT dept_id, dept_name, color FROM dim_department ORDER BY rowid")
+
+def reserve_ids(n):
+    """Claim n ids from the persisted id_sequence; pass the result to uid()"""
+    # One small write per batch; the high-water mark survives restarts, so a
+    # new process never hands out an id an earlier one already used
+    with write_txn() as conn:
+        start = conn.execute("SELECT next_id FROM id_sequence WHERE name = 'uid'").fetchone()[0]
+        conn.execute("UPDATE id_sequence SET next_id = ? WHERE name = 'uid'", (start + n,))
+    return iter(range(start, start + n))
+
+def uid(prefix, ids):
+    return f"{prefix}_{next(ids):012x}"
 
 def sha256(text):
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 def to_date_id(d):
-    return int(d.strftime("%Y%m%d"))
+    return d.year * 10000 + d.month * 100 + d.day
 
 def from_date_id(date_id):
-    s = str(date_id)
-    return date(int(s[:4]), int(s[4:6]), int(s[6:8]))
+    date_id = int(date_id)
+    return date(date_id // 10000, date_id // 100 % 100, date_id % 100)
 
 # ============================================================
 # DATABASE INITIALIZATION
 # ============================================================
+@st.cache_resource
 def init_db():
+    # Schema setup runs once per server process, not on every rerun
     conn = get_conn()
     cur = conn.cursor()
     
@@ -246,7 +392,8 @@ def init_db():
         tags TEXT,
         created_by TEXT,
         created_ts TEXT,
-        updated_ts TEXT
+        updated_ts TEXT,
+        content_hash TEXT
     )""")
     
     # Dataset Records - เก็บข้อมูลจริง (แบบ EAV - Entity-Attribute-Value)
@@ -304,31 +451,84 @@ def init_db():
         created_ts TEXT
     )""")
     
+    # High-water mark for uid(); ids are claimed in blocks by reserve_ids()
+    cur.execute("""CREATE TABLE IF NOT EXISTS id_sequence (
+        name TEXT PRIMARY KEY, next_id INTEGER NOT NULL
+    )""")
+    
+    # ========== MIGRATIONS ==========
+    if cur.execute("SELECT 1 FROM id_sequence WHERE name = 'uid'").fetchone() is None:
+        # Start above the clock and above every counter id already stored
+        # (prefix + '_' + 13 hex digits; older uuid ids are shorter)
+        next_id = time.time_ns() // 1000
+        for table, col, prefix in (("fact_kpi_data", "record_id", "KPI"), ("workspace_data", "data_id", "DATA"),
+                                   ("workspace_datasets", "dataset_id", "DS"),
+                                   ("workspace_categories", "category_id", "CAT")):
+            top = cur.execute(f"SELECT MAX({col}) FROM {table} WHERE {col} LIKE ? AND length({col}) = ?",
+                              (f"{prefix}_%", len(prefix) + 14)).fetchone()[0]
+            try:
+                next_id = max(next_id, int(top.rsplit("_", 1)[1], 16) + 1)
+            except (AttributeError, ValueError):
+                pass
+        cur.execute("INSERT INTO id_sequence (name, next_id) VALUES ('uid', ?)", (next_id,))
+    dataset_cols = {row[1] for row in cur.execute("PRAGMA table_info(workspace_datasets)")}
+    if "content_hash" not in dataset_cols:
+        cur.execute("ALTER TABLE workspace_datasets ADD COLUMN content_hash TEXT")
+    
+    # ========== INDEXES ==========
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_kpi_data_dept_date ON fact_kpi_data(dept_id, date_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_kpi_data_date ON fact_kpi_data(date_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_workspace_data_dataset ON workspace_data(dataset_id, row_index)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_category_mappings_dataset ON workspace_category_mappings(dataset_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_kpi_data_kpi_date ON fact_kpi_data(kpi_id, date_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_workspace_datasets_hash ON workspace_datasets(content_hash)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_workspace_datasets_updated ON workspace_datasets(updated_ts DESC)")
+    
     conn.commit()
-    conn.close()
+    cur.execute("PRAGMA optimize")
+    atexit.register(optimize_at_exit, conn, get_write_lock())
+
+def optimize_at_exit(conn, lock):
+    # Refresh planner stats with whatever the session workload taught SQLite;
+    # skip it if a writer still holds the connection or it is already closed
+    if not lock.acquire(timeout=5):
+        return
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    finally:
+        lock.release()
+
+@st.cache_resource
+def known_date_ids():
+    # Process-wide set of date_ids already in dim_date; kept in sync by ensure_dim_date
+    return {row['date_id'] for row in fetch_rows("SELECT date_id FROM dim_date")}
 
 def ensure_dim_date(start_date, end_date):
-    conn = get_conn()
-    cur = conn.cursor()
-    d = start_date
-    while d <= end_date:
-        date_id = to_date_id(d)
-        cur.execute("""INSERT OR IGNORE INTO dim_date 
-            (date_id, date, month, quarter, year, week) VALUES (?, ?, ?, ?, ?, ?)""",
-            (date_id, d.isoformat(), d.month, (d.month-1)//3+1, d.year, d.isocalendar()[1]))
-        d += timedelta(days=1)
-    conn.commit()
-    conn.close()
+    known = known_date_ids()
+    days = (start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1))
+    # date_id computed once per day; only unknown days are built into rows
+    rows = [(date_id, d.isoformat(), d.month, (d.month-1)//3+1, d.year, d.isocalendar()[1])
+            for d, date_id in ((d, to_date_id(d)) for d in days) if date_id not in known]
+    if not rows:
+        return
+    with write_txn() as conn:
+        conn.executemany("""INSERT OR IGNORE INTO dim_date 
+            (date_id, date, month, quarter, year, week) VALUES (?, ?, ?, ?, ?, ?)""", rows)
+    known.update(row[0] for row in rows)
 
 # ============================================================
 # SEED DEMO DATA
 # ============================================================
 def seed_demo_data():
     today = date.today()
+    now_ts = datetime.now().isoformat()  # one timestamp for every seeded row
     ensure_dim_date(today - timedelta(days=365), today + timedelta(days=90))
+    seed = {}
     
     # Departments
-    replace_table("dim_department", pd.DataFrame([
+    seed["dim_department"] = pd.DataFrame([
         {"dept_id": "MDS", "dept_name": "Marketing & Sales", "dept_code": "MDS", 
          "description": "การตลาดและการขาย", "color": "#06b6d4"},
         {"dept_id": "SGS", "dept_name": "Strategy & Planning", "dept_code": "SGS",
@@ -337,19 +537,19 @@ def seed_demo_data():
          "description": "กำกับดูแลและความสอดคล้อง", "color": "#10b981"},
         {"dept_id": "IT", "dept_name": "IT Operations", "dept_code": "IT",
          "description": "เทคโนโลยีสารสนเทศ", "color": "#8b5cf6"},
-    ]))
+    ])
     
     # Persons
-    replace_table("dim_person", pd.DataFrame([
+    seed["dim_person"] = pd.DataFrame([
         {"person_id": "P1", "person_name": "ผู้อำนวยการ", "role": "Executive", "department": "Management"},
         {"person_id": "P2", "person_name": "หัวหน้า MDS", "role": "DeptHead", "department": "MDS"},
         {"person_id": "P3", "person_name": "หัวหน้า SGS", "role": "DeptHead", "department": "SGS"},
         {"person_id": "P4", "person_name": "หัวหน้า BMS", "role": "DeptHead", "department": "BMS"},
         {"person_id": "P5", "person_name": "หัวหน้า IT", "role": "DeptHead", "department": "IT"},
-    ]))
+    ])
     
     # KPIs
-    replace_table("dim_kpi", pd.DataFrame([
+    seed["dim_kpi"] = pd.DataFrame([
         {"kpi_id": "MDS_K1", "kpi_name": "Lead Volume", "dept_id": "MDS", "unit": "leads", "target_direction": "higher_is_better"},
         {"kpi_id": "MDS_K2", "kpi_name": "Conversion Rate", "dept_id": "MDS", "unit": "%", "target_direction": "higher_is_better"},
         {"kpi_id": "MDS_K3", "kpi_name": "Pipeline Value", "dept_id": "MDS", "unit": "MB", "target_direction": "higher_is_better"},
@@ -359,35 +559,33 @@ def seed_demo_data():
         {"kpi_id": "BMS_K2", "kpi_name": "Audit Findings", "dept_id": "BMS", "unit": "items", "target_direction": "lower_is_better"},
         {"kpi_id": "IT_K1", "kpi_name": "System Uptime", "dept_id": "IT", "unit": "%", "target_direction": "higher_is_better"},
         {"kpi_id": "IT_K2", "kpi_name": "Incident Count", "dept_id": "IT", "unit": "incidents", "target_direction": "lower_is_better"},
-    ]))
+    ])
     
     # Generate KPI Data
-    import random
-    kpi_data = []
+    # Column lists instead of per-row dicts: one DataFrame build, no dict boxing
+    kpi_cols = {c: [] for c in ("date_id", "dept_id", "kpi_id", "actual_value", "target_value")}
     for i in range(90):
-        d = today - timedelta(days=89-i)
-        date_id = to_date_id(d)
-        
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "MDS", "kpi_id": "MDS_K1",
-                        "actual_value": random.randint(80, 150) + i*0.3, "target_value": 100, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "MDS", "kpi_id": "MDS_K2",
-                        "actual_value": random.uniform(15, 30), "target_value": 25, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "MDS", "kpi_id": "MDS_K3",
-                        "actual_value": random.uniform(50, 100) + i*0.5, "target_value": 80, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "SGS", "kpi_id": "SGS_K1",
-                        "actual_value": min(45 + i*0.5 + random.uniform(-5, 5), 100), "target_value": 80, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "SGS", "kpi_id": "SGS_K2",
-                        "actual_value": max(70 - i*0.2 + random.uniform(-5, 5), 20), "target_value": 40, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "BMS", "kpi_id": "BMS_K1",
-                        "actual_value": min(85 + i*0.1 + random.uniform(-2, 2), 99), "target_value": 95, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "BMS", "kpi_id": "BMS_K2",
-                        "actual_value": max(15 - i*0.1 + random.uniform(-2, 2), 2), "target_value": 5, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "IT", "kpi_id": "IT_K1",
-                        "actual_value": random.uniform(99.0, 99.99), "target_value": 99.5, "created_ts": datetime.now().isoformat()})
-        kpi_data.append({"record_id": uid("KPI"), "date_id": date_id, "dept_id": "IT", "kpi_id": "IT_K2",
-                        "actual_value": random.randint(0, 5), "target_value": 2, "created_ts": datetime.now().isoformat()})
-    
-    replace_table("fact_kpi_data", pd.DataFrame(kpi_data))
+        date_id = to_date_id(today - timedelta(days=89-i))
+        for dept_id, kpi_id, actual, target in (
+            ("MDS", "MDS_K1", random.randint(80, 150) + i*0.3, 100),
+            ("MDS", "MDS_K2", random.uniform(15, 30), 25),
+            ("MDS", "MDS_K3", random.uniform(50, 100) + i*0.5, 80),
+            ("SGS", "SGS_K1", min(45 + i*0.5 + random.uniform(-5, 5), 100), 80),
+            ("SGS", "SGS_K2", max(70 - i*0.2 + random.uniform(-5, 5), 20), 40),
+            ("BMS", "BMS_K1", min(85 + i*0.1 + random.uniform(-2, 2), 99), 95),
+            ("BMS", "BMS_K2", max(15 - i*0.1 + random.uniform(-2, 2), 2), 5),
+            ("IT", "IT_K1", random.uniform(99.0, 99.99), 99.5),
+            ("IT", "IT_K2", random.randint(0, 5), 2),
+        ):
+            kpi_cols["date_id"].append(date_id)
+            kpi_cols["dept_id"].append(dept_id)
+            kpi_cols["kpi_id"].append(kpi_id)
+            kpi_cols["actual_value"].append(actual)
+            kpi_cols["target_value"].append(target)
+    kpi_cols["created_ts"] = now_ts
+    
+    ids = reserve_ids(len(kpi_cols["kpi_id"]))
+    seed["fact_kpi_data"] = pd.DataFrame({"record_id": [uid("KPI", ids) for _ in kpi_cols["kpi_id"]], **kpi_cols})
     
     # Sample Categories for Data Workspace
     categories = [
@@ -403,12 +601,12 @@ def seed_demo_data():
          "description": "ช่วงเวลา", "color": "#ef4444", "icon": "📅"},
     ]
     for cat in categories:
-        cat["created_ts"] = datetime.now().isoformat()
-    replace_table("workspace_categories", pd.DataFrame(categories))
+        cat["created_ts"] = now_ts
+    seed["workspace_categories"] = pd.DataFrame(categories)
     
     # Sample Dataset
     dataset_id = "DS_SALES_2024"
-    replace_table("workspace_datasets", pd.DataFrame([{
+    seed["workspace_datasets"] = pd.DataFrame([{
         "dataset_id": dataset_id,
         "dataset_name": "Sales Data 2024",
         "description": "ข้อมูลยอดขายประจำปี 2024",
@@ -419,9 +617,9 @@ def seed_demo_data():
         "columns_json": json.dumps(["date", "region", "product", "customer_segment", "channel", "quantity", "revenue", "cost"]),
         "tags": "sales,revenue,2024",
         "created_by": "admin",
-        "created_ts": datetime.now().isoformat(),
-        "updated_ts": datetime.now().isoformat()
-    }]))
+        "created_ts": now_ts,
+        "updated_ts": now_ts
+    }])
     
     # Generate sample sales data
     regions = ["North", "South", "East", "West", "Central"]
@@ -429,7 +627,7 @@ def seed_demo_data():
     segments = ["Enterprise", "SME", "Retail", "Government"]
     channels = ["Direct", "Online", "Partner", "Retail"]
     
-    sales_data = []
+    data_json = []
     for i in range(100):
         d = today - timedelta(days=random.randint(0, 90))
         row_data = {
@@ -442,34 +640,47 @@ def seed_demo_data():
             "revenue": random.randint(50000, 500000),
             "cost": random.randint(30000, 300000)
         }
-        sales_data.append({
-            "data_id": uid("DATA"),
-            "dataset_id": dataset_id,
-            "row_index": i,
-            "data_json": json.dumps(row_data),
-            "created_ts": datetime.now().isoformat()
-        })
+        data_json.append(json.dumps(row_data))
     
-    replace_table("workspace_data", pd.DataFrame(sales_data))
+    ids = reserve_ids(len(data_json))
+    seed["workspace_data"] = pd.DataFrame({
+        "data_id": [uid("DATA", ids) for _ in data_json],
+        "dataset_id": dataset_id,
+        "row_index": range(len(data_json)),
+        "data_json": data_json,
+        "created_ts": now_ts,
+    })
+    
+    # Users (all share the demo password; hash it once)
+    demo_hash = sha256("demo123")
+    seed["dim_user"] = pd.DataFrame([
+        {"username": "admin", "password_hash": demo_hash, "role": "Admin", "dept_id": None, "is_enabled": 1},
+        {"username": "executive", "password_hash": demo_hash, "role": "Executive", "dept_id": None, "is_enabled": 1},
+        {"username": "mds_head", "password_hash": demo_hash, "role": "DeptHead", "dept_id": "MDS", "is_enabled": 1},
+        {"username": "sgs_head", "password_hash": demo_hash, "role": "DeptHead", "dept_id": "SGS", "is_enabled": 1},
+        {"username": "bms_head", "password_hash": demo_hash, "role": "DeptHead", "dept_id": "BMS", "is_enabled": 1},
+        {"username": "it_head", "password_hash": demo_hash, "role": "DeptHead", "dept_id": "IT", "is_enabled": 1},
+    ])
     
-    # Users
-    replace_table("dim_user", pd.DataFrame([
-        {"username": "admin", "password_hash": sha256("demo123"), "role": "Admin", "dept_id": None, "is_enabled": 1},
-        {"username": "executive", "password_hash": sha256("demo123"), "role": "Executive", "dept_id": None, "is_enabled": 1},
-        {"username": "mds_head", "password_hash": sha256("demo123"), "role": "DeptHead", "dept_id": "MDS", "is_enabled": 1},
-        {"username": "sgs_head", "password_hash": sha256("demo123"), "role": "DeptHead", "dept_id": "SGS", "is_enabled": 1},
-        {"username": "bms_head", "password_hash": sha256("demo123"), "role": "DeptHead", "dept_id": "BMS", "is_enabled": 1},
-        {"username": "it_head", "password_hash": sha256("demo123"), "role": "DeptHead", "dept_id": "IT", "is_enabled": 1},
-    ]))
+    replace_tables(seed)
+    load_departments.clear()
+    load_categories.clear()
+    invalidate_dataset_caches()
 
 # ============================================================
 # AUTH HELPERS
 # ============================================================
+# Fixed text with explicit columns: sqlite3's per-connection statement cache
+# reuses the compiled statement on every Add User
+INSERT_USER_SQL = ("INSERT INTO dim_user (username, password_hash, role, dept_id, person_id, is_enabled) "
+                   "VALUES (?, ?, ?, ?, ?, 1)")
+
 def login(username, password):
-    df = read_df("SELECT * FROM dim_user WHERE username = ? AND is_enabled = 1", params=(username,))
-    if df.empty:
+    rows = fetch_rows("SELECT username, password_hash, role, dept_id FROM dim_user WHERE username = ? AND is_enabled = 1",
+                      (username,))
+    if not rows:
         return False
-    row = df.iloc[0].to_dict()
+    row = rows[0]
     if row["password_hash"] != sha256(password):
         return False
     st.session_state["auth"] = {
@@ -511,26 +722,27 @@ def generate_insights(dept_id=None):
     today_id = to_date_id(date.today())
     week_ago_id = to_date_id(date.today() - timedelta(days=7))
     
-    where_clause = f"AND k.dept_id = '{dept_id}'" if dept_id else ""
+    where_clause = "AND k.dept_id = ?" if dept_id else ""
+    params = (week_ago_id, dept_id) if dept_id else (week_ago_id,)
+    # Only the latest reading per KPI is used; let SQLite pick it
     kpi_df = read_df(f"""
-        SELECT k.*, d.kpi_name, d.target_direction
-        FROM fact_kpi_data k
-        JOIN dim_kpi d ON k.kpi_id = d.kpi_id
-        WHERE k.date_id >= {week_ago_id} {where_clause}
-        ORDER BY k.date_id DESC
-    """)
-    
-    if kpi_df.empty:
-        return insights
-    
-    for kpi_id in kpi_df['kpi_id'].unique():
-        kpi_data = kpi_df[kpi_df['kpi_id'] == kpi_id].copy()
-        kpi_name = kpi_data.iloc[0]['kpi_name']
-        target_direction = kpi_data.iloc[0].get('target_direction', 'higher_is_better')
-        
-        latest = kpi_data.iloc[0]
-        actual = latest['actual_value']
-        target = latest['target_value']
+        SELECT kpi_id, kpi_name, target_direction, actual_value, target_value
+        FROM (
+            SELECT k.kpi_id, k.date_id, k.actual_value, k.target_value, d.kpi_name, d.target_direction,
+                   ROW_NUMBER() OVER (PARTITION BY k.kpi_id ORDER BY k.date_id DESC, k.record_id DESC) AS rn
+            FROM fact_kpi_data k
+            JOIN dim_kpi d ON k.kpi_id = d.kpi_id
+            WHERE k.date_id >= ? {where_clause}
+        )
+        WHERE rn = 1
+        ORDER BY date_id DESC, kpi_id
+    """, params)
+    
+    for latest in kpi_df.itertuples(index=False):
+        kpi_name = latest.kpi_name
+        target_direction = latest.target_direction
+        actual = latest.actual_value
+        target = latest.target_value
         
         if target and actual:
             if target_direction == 'higher_is_better':
@@ -553,22 +765,30 @@ def generate_insights(dept_id=None):
 # ============================================================
 # EXPORT FUNCTIONS
 # ============================================================
+# Download links are rebuilt on every rerun of the pages that show them;
+# cache the encoded payload per (frame, filename) so only changes pay for it.
+# Payloads can be several MB each, so keep only a few, briefly
+EXPORT_CACHE = dict(show_spinner=False, max_entries=8, ttl=600)
+
+@st.cache_data(**EXPORT_CACHE)
 def export_to_excel(df, filename):
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         df.to_excel(writer, index=False, sheet_name='Data')
         worksheet = writer.sheets['Data']
         for i, col in enumerate(df.columns):
-            max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
+            max_len = max(df[col].astype(str).str.len().max(), len(col)) + 2
             worksheet.set_column(i, i, min(max_len, 50))
-    b64 = base64.b64encode(output.getvalue()).decode()
+    b64 = base64.b64encode(output.getbuffer()).decode()
     return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}.xlsx">📥 Download Excel</a>'
 
+@st.cache_data(**EXPORT_CACHE)
 def export_to_csv(df, filename):
     csv = df.to_csv(index=False)
     b64 = base64.b64encode(csv.encode()).decode()
     return f'<a href="data:file/csv;base64,{b64}" download="{filename}.csv">📥 Download CSV</a>'
 
+@st.cache_data(**EXPORT_CACHE)
 def export_to_json(df, filename):
     json_str = df.to_json(orient='records', date_format='iso', indent=2)
     b64 = base64.b64encode(json_str.encode()).decode()
@@ -577,6 +797,24 @@ def export_to_json(df, filename):
 # ============================================================
 # VISUALIZATION HELPERS
 # ============================================================
+# Shared chart styling, built once instead of as fresh literals per figure
+CHART_THEME = dict(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8')
+GRID_AXIS = dict(showgrid=True, gridcolor='rgba(71, 85, 105, 0.3)')
+CHART_MARGIN = dict(l=20, r=20, t=50, b=20)
+
+@st.cache_resource
+def load_plotly_express():
+    # Deferred so pages without charts (login, reports, admin) skip the import
+    import plotly.express as px
+    return px
+
+def render_insight_cards(items):
+    """Render insight/finding dicts as one markdown block (one delta, not one per card)"""
+    st.markdown("".join(
+        f'<div class="insight-card {item["type"]}">{item["icon"]} {item["text"]}</div>'
+        for item in items
+    ), unsafe_allow_html=True)
+
 def create_kpi_card(title, value, target, unit="", trend_direction=None, trend_value=None):
     if target:
         ratio = value / target if target != 0 else 1
@@ -612,38 +850,37 @@ def create_kpi_card(title, value, target, unit="", trend_direction=None, trend_v
     """
 
 def create_trend_chart(df, x_col, y_col, title, color="#3b82f6"):
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
+    # The figure shape is fixed: build traces + layout in one constructor call
+    # instead of add_trace/update_layout, which re-validate the figure each time
+    traces = [go.Scattergl(
         x=df[x_col], y=df[y_col],
         mode='lines+markers',
         name='Actual',
         line=dict(color=color, width=2),
         marker=dict(size=6)
-    ))
+    )]
     if 'target_value' in df.columns:
-        fig.add_trace(go.Scatter(
+        traces.append(go.Scattergl(
             x=df[x_col], y=df['target_value'],
             mode='lines',
             name='Target',
             line=dict(color='#ef4444', width=2, dash='dash')
         ))
-    fig.update_layout(
+    return go.Figure(data=traces, layout=dict(
         title=title,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font_color='#94a3b8',
-        xaxis=dict(showgrid=True, gridcolor='rgba(71, 85, 105, 0.3)'),
-        yaxis=dict(showgrid=True, gridcolor='rgba(71, 85, 105, 0.3)'),
+        **CHART_THEME,
+        xaxis=GRID_AXIS,
+        yaxis=GRID_AXIS,
         legend=dict(orientation='h', yanchor='bottom', y=1.02),
+        hovermode='closest',
         height=350,
-        margin=dict(l=20, r=20, t=50, b=20)
-    )
-    return fig
+        margin=CHART_MARGIN
+    ))
 
 def create_gauge_chart(value, target, title, max_val=None):
     if max_val is None:
         max_val = max(value, target) * 1.2
-    fig = go.Figure(go.Indicator(
+    return go.Figure(go.Indicator(
         mode="gauge+number+delta",
         value=value,
         delta={'reference': target, 'relative': True, 'valueformat': '.1%'},
@@ -659,13 +896,161 @@ def create_gauge_chart(value, target, title, max_val=None):
             ],
             'threshold': {'line': {'color': '#ef4444', 'width': 4}, 'thickness': 0.75, 'value': target}
         }
-    ))
-    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8', height=250, margin=dict(l=20, r=20, t=50, b=20))
-    return fig
+    ), layout=dict(**CHART_THEME, height=250, margin=CHART_MARGIN))
 
 # ============================================================
 # DATA WORKSPACE - MAIN FEATURE
 # ============================================================
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+def shrink_ints(df):
+    """Narrow int64 columns whose values fit into int32 (halves them in cached frames)"""
+    for col in df.select_dtypes(include='int64').columns:
+        if df[col].between(INT32_MIN, INT32_MAX).all():
+            df[col] = df[col].astype(np.int32)
+    return df
+
+# Tried in order against the whole upload; latin-1 always decodes
+CSV_ENCODINGS = ("utf-8-sig", "cp874", "latin-1")
+
+def detect_csv_encoding(file_bytes, block_size=1024 * 1024):
+    """Pick the first encoding that decodes the entire file (Thai exports are often cp874)"""
+    # Validating only a head sample picked utf-8 for cp874 files whose first
+    # rows are ASCII, and the full parse then failed; decode every block but
+    # discard the text, so memory stays at one block
+    view = memoryview(file_bytes)
+    for encoding in CSV_ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            for start in range(0, len(view), block_size):
+                decoder.decode(view[start:start + block_size], final=False)
+            decoder.decode(b"", final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CSV_ENCODINGS[-1]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def csv_encoding(content_hash, _file_bytes):
+    """Detected encoding of an upload, decoded once per content hash and shared by both parsers"""
+    return detect_csv_encoding(_file_bytes)
+
+def read_csv_fast(file, encoding="utf-8"):
+    """Parse an uploaded CSV, using the multithreaded pyarrow engine when available"""
+    file.seek(0)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return pd.read_csv(file, encoding=encoding, engine='c', low_memory=False, cache_dates=True)
+    return pd.read_csv(file, encoding=encoding, engine='pyarrow')
+
+# Upload parsers are keyed on the content hash the Import page computes anyway;
+# the raw bytes are passed underscore-prefixed so Streamlit doesn't hash them again
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_upload(content_hash, file_name, _file_bytes):
+    """Parse uploaded bytes once; reruns with the same upload hit the cache"""
+    buffer = io.BytesIO(_file_bytes)
+    if file_name.endswith('.csv'):
+        return shrink_ints(read_csv_fast(buffer, encoding=csv_encoding(content_hash, _file_bytes)))
+    return shrink_ints(pd.read_excel(buffer))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_preview(content_hash, file_name, _file_bytes, nrows=10):
+    """Parse only the first rows of an upload for the preview table"""
+    buffer = io.BytesIO(_file_bytes)
+    if file_name.endswith('.csv'):
+        return pd.read_csv(buffer, nrows=nrows, encoding=csv_encoding(content_hash, _file_bytes))
+    return pd.read_excel(buffer, nrows=nrows)
+
+WORKSPACE_DATA_COLUMNS = ("data_id", "dataset_id", "row_index", "data_json", "created_ts")
+
+def workspace_data_rows(df, dataset_id, start, created_ts, ids):
+    """Serialize one IMPORT_CHUNK_ROWS slice of df into workspace_data row tuples"""
+    # ids comes from reserve_ids() on the script thread: this runs on a
+    # worker thread, and uid() is plain formatting with no Streamlit calls
+    chunk = df.iloc[start:start + IMPORT_CHUNK_ROWS]
+    columns = [str(col) for col in chunk.columns]
+    # Column-wise tolist() converts to Python scalars in C; rows are then just zips
+    values = zip(*(chunk[col].tolist() for col in chunk.columns))
+    return [(uid("DATA", ids), dataset_id, start + i, json.dumps(dict(zip(columns, row)), default=str), created_ts)
+            for i, row in enumerate(values)]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_dataset_choices():
+    """{dataset_id: label} for the dataset pickers (cached; cleared on dataset writes)"""
+    rows = fetch_rows("SELECT dataset_id, dataset_name, dept_id, created_ts FROM workspace_datasets "
+                      "ORDER BY dataset_name, created_ts")
+    # Names aren't unique; tell same-named datasets apart by department and import date
+    name_counts = collections.Counter(row['dataset_name'] for row in rows)
+    return {row['dataset_id']: row['dataset_name'] if name_counts[row['dataset_name']] == 1
+            else f"{row['dataset_name']} ({row['dept_id'] or 'All'}, {(row['created_ts'] or '')[:10]})"
+            for row in rows}
+
+def load_dataset_df(dataset_id):
+    """Load a workspace dataset as a DataFrame the caller owns (cached; cleared on dataset writes)"""
+    # Shallow copy of the shared frame: with copy-on-write it costs no data
+    # copy, yet in-place edits (casts, inplace=, column writes) stay private
+    return load_dataset_frame(dataset_id).copy(deep=False)
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def load_dataset_frame(dataset_id):
+    """One decoded frame per dataset shared by all sessions; use load_dataset_df() instead"""
+    # Decode chunk by chunk so only one chunk of raw JSON text is alive at a time
+    rows = []
+    chunks = read_df("SELECT data_json FROM workspace_data WHERE dataset_id = ? ORDER BY row_index",
+                     (dataset_id,), chunksize=READ_CHUNK_ROWS)
+    with closing(chunks):
+        for chunk in chunks:
+            rows.extend(json.loads(data_json) for data_json in chunk['data_json'])
+    return shrink_ints(pd.DataFrame(rows))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def detect_date_columns(dataset_id):
+    """Text columns of a dataset that parse as dates (cached; cleared on dataset writes)"""
+    df = load_dataset_df(dataset_id)
+    date_cols = []
+    for col in df.select_dtypes(include=['object']).columns:
+        try:
+            pd.to_datetime(df[col])
+            date_cols.append(col)
+        except Exception:
+            pass
+    return date_cols
+
+@st.cache_data(ttl=60, show_spinner=False)
+def compute_trend(dataset_id, date_col, group_category, metric_col, granularity):
+    """Per-period sum/mean/count of metric_col, optionally per category (cached per selection)"""
+    df = load_dataset_df(dataset_id)
+    dates = pd.to_datetime(df[date_col])
+    if granularity == "Day":
+        period = dates.dt.date
+    else:
+        freq = {"Week": "W", "Month": "M", "Quarter": "Q"}[granularity]
+        period = dates.dt.to_period(freq).dt.start_time
+    df['period'] = period
+    
+    if group_category == "Overall":
+        trend_df = df.groupby('period')[metric_col].agg(['sum', 'mean', 'count']).reset_index()
+        trend_df.columns = ['period', 'total', 'average', 'count']
+    else:
+        trend_df = df.groupby(['period', group_category])[metric_col].agg(['sum', 'mean', 'count']).reset_index()
+        trend_df.columns = ['period', group_category, 'total', 'average', 'count']
+    return trend_df
+
+def invalidate_dataset_caches():
+    load_dataset_choices.clear()
+    load_dataset_frame.clear()
+    detect_date_columns.clear()
+    compute_trend.clear()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_categories():
+    """Workspace categories for the Category Manager (cached; cleared on category writes)"""
+    return read_df("""
+        SELECT category_id, category_name, category_type, description, color, icon
+        FROM workspace_categories ORDER BY category_type, category_name
+    """)
+
 def render_data_workspace():
     """Render the Data Workspace - Central hub for data management and analysis"""
     st.markdown("## 🗄️ Data Workspace")
@@ -704,13 +1089,18 @@ def render_data_workspace():
     with tabs[5]:
         render_insights_generator()
 
+@st.fragment
 def render_dataset_catalog():
     """Dataset Catalog - View and manage all datasets"""
     st.markdown("### 📚 Dataset Catalog")
     st.markdown("รายการ Datasets ทั้งหมดในระบบ")
     
-    # Load datasets
-    datasets = read_df("SELECT * FROM workspace_datasets ORDER BY updated_ts DESC")
+    # Load datasets (only the fields the cards and metrics render)
+    datasets = read_df("""
+        SELECT dataset_id, dataset_name, description, dept_id, row_count, column_count,
+               columns_json, tags, updated_ts
+        FROM workspace_datasets ORDER BY updated_ts DESC
+    """)
     
     if datasets.empty:
         st.info("ยังไม่มี Dataset ในระบบ กรุณา Import ข้อมูลก่อน")
@@ -727,32 +1117,32 @@ def render_dataset_catalog():
         depts = datasets['dept_id'].nunique()
         st.metric("Departments", depts)
     with col4:
-        recent = len(datasets[pd.to_datetime(datasets['updated_ts']) > datetime.now() - timedelta(days=7)])
+        recent = int((pd.to_datetime(datasets['updated_ts']) > datetime.now() - timedelta(days=7)).sum())
         st.metric("Updated This Week", recent)
     
     st.markdown("---")
     
     # Dataset Cards
-    for _, ds in datasets.iterrows():
-        cols = json.loads(ds['columns_json']) if ds['columns_json'] else []
-        tags = ds['tags'].split(',') if ds['tags'] else []
+    for ds in datasets.itertuples(index=False):
+        cols = json.loads(ds.columns_json) if ds.columns_json else []
+        tags = ds.tags.split(',') if ds.tags else []
         
         st.markdown(f"""
         <div class="data-card">
             <div style="display: flex; justify-content: space-between; align-items: flex-start;">
                 <div>
-                    <h3 style="color: white; margin: 0;">📊 {ds['dataset_name']}</h3>
-                    <p style="color: #64748b; font-size: 0.9rem;">{ds['description'] or 'No description'}</p>
+                    <h3 style="color: white; margin: 0;">📊 {ds.dataset_name}</h3>
+                    <p style="color: #64748b; font-size: 0.9rem;">{ds.description or 'No description'}</p>
                 </div>
                 <div style="text-align: right;">
                     <span style="color: #22c55e; font-size: 0.8rem;">● Active</span>
                 </div>
             </div>
             <div style="margin-top: 1rem; display: flex; gap: 2rem; color: #94a3b8; font-size: 0.85rem;">
-                <span>📁 {ds['row_count']:,} rows</span>
-                <span>📋 {ds['column_count']} columns</span>
-                <span>🏢 {ds['dept_id'] or 'All'}</span>
-                <span>📅 {ds['updated_ts'][:10] if ds['updated_ts'] else 'N/A'}</span>
+                <span>📁 {ds.row_count:,} rows</span>
+                <span>📋 {ds.column_count} columns</span>
+                <span>🏢 {ds.dept_id or 'All'}</span>
+                <span>📅 {ds.updated_ts[:10] if ds.updated_ts else 'N/A'}</span>
             </div>
             <div style="margin-top: 0.5rem;">
                 {''.join([f'<span class="category-tag">{tag.strip()}</span>' for tag in tags[:5]])}
@@ -763,43 +1153,89 @@ def render_dataset_catalog():
         # Action buttons
         col1, col2, col3, col4 = st.columns([1,1,1,3])
         with col1:
-            if st.button("🔍 View", key=f"view_{ds['dataset_id']}"):
-                st.session_state['selected_dataset'] = ds['dataset_id']
+            if st.button("🔍 View", key=f"view_{ds.dataset_id}"):
+                st.session_state['selected_dataset'] = ds.dataset_id
                 st.session_state['workspace_tab'] = 3  # Go to Explorer
         with col2:
-            if st.button("📊 Analyze", key=f"analyze_{ds['dataset_id']}"):
-                st.session_state['selected_dataset'] = ds['dataset_id']
+            if st.button("📊 Analyze", key=f"analyze_{ds.dataset_id}"):
+                st.session_state['selected_dataset'] = ds.dataset_id
                 st.session_state['workspace_tab'] = 4  # Go to Trend
         with col3:
-            if st.button("🗑️ Delete", key=f"delete_{ds['dataset_id']}"):
-                exec_sql("DELETE FROM workspace_data WHERE dataset_id = ?", (ds['dataset_id'],))
-                exec_sql("DELETE FROM workspace_datasets WHERE dataset_id = ?", (ds['dataset_id'],))
+            if st.button("🗑️ Delete", key=f"delete_{ds.dataset_id}"):
+                exec_many_sql([
+                    ("DELETE FROM workspace_data WHERE dataset_id = ?", (ds.dataset_id,)),
+                    ("DELETE FROM workspace_datasets WHERE dataset_id = ?", (ds.dataset_id,)),
+                ])
+                invalidate_dataset_caches()
                 st.success("Deleted!")
                 st.rerun()
         
         st.markdown("---")
 
+@st.fragment
 def render_data_import_workspace():
     """Import data to workspace"""
     st.markdown("### 📤 Import Data to Workspace")
     
+    # Set by a successful save just before its full-app rerun
+    saved_msg = st.session_state.pop('import_saved_msg', None)
+    if saved_msg:
+        st.success(saved_msg)
+        st.balloons()
+    
     col1, col2 = st.columns([2, 1])
     
+    # Static guidance first, so an early return from the upload flow can't skip it
+    with col2:
+        st.markdown("### 📋 Import Guidelines")
+        st.info("""
+        **Supported Formats:**
+        - Excel (.xlsx, .xls)
+        - CSV (.csv)
+        
+        **Best Practices:**
+        - Headers in first row
+        - Consistent data types per column
+        - Date format: YYYY-MM-DD
+        - No merged cells
+        
+        **Recommended Columns:**
+        - Date/Time column for trends
+        - Category columns for grouping
+        - Numeric columns for analysis
+        """)
+        
+        st.markdown("### 🏷️ Suggested Tags")
+        st.markdown("""
+        - `sales` - ข้อมูลยอดขาย
+        - `finance` - ข้อมูลการเงิน
+        - `hr` - ข้อมูลบุคลากร
+        - `operations` - ข้อมูลปฏิบัติการ
+        - `customers` - ข้อมูลลูกค้า
+        """)
+    
     with col1:
         uploaded_file = st.file_uploader("Upload Excel or CSV", type=['xlsx', 'xls', 'csv'], key="workspace_upload")
         
         if uploaded_file:
             try:
-                if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
+                file_bytes = uploaded_file.getvalue()
+                content_hash = hashlib.sha256(file_bytes).hexdigest()
                 
-                st.success(f"✅ Loaded: {len(df)} rows, {len(df.columns)} columns")
-                
-                # Preview
+                # Preview from the first rows only, rendered before the full parse
                 st.markdown("#### Preview")
-                st.dataframe(df.head(10), use_container_width=True)
+                st.dataframe(parse_preview(content_hash, uploaded_file.name, file_bytes), use_container_width=True)
+                
+                # Same bytes already imported? Skip the full parse unless the user
+                # explicitly wants another copy (e.g. under another name/department)
+                duplicate = fetch_rows("SELECT dataset_name FROM workspace_datasets WHERE content_hash = ?", (content_hash,))
+                if duplicate:
+                    st.warning(f"⚠️ This file is already in the workspace as '{duplicate[0]['dataset_name']}'")
+                    if not st.checkbox("Import anyway", key=f"import_dup_{content_hash}"):
+                        return
+                
+                df = parse_upload(content_hash, uploaded_file.name, file_bytes)
+                st.success(f"✅ Loaded: {len(df)} rows, {len(df.columns)} columns")
                 
                 # Column info
                 st.markdown("#### Column Information")
@@ -807,88 +1243,80 @@ def render_data_import_workspace():
                     'Column': df.columns,
                     'Type': df.dtypes.astype(str),
                     'Non-Null': df.count().values,
-                    'Unique': [df[col].nunique() for col in df.columns]
+                    'Unique': df.nunique().values
+                })
+                st.dataframe(col_info, use_container_width=True, hide_index=True, column_config={
+                    'Column': st.column_config.TextColumn(width='medium'),
+                    'Type': st.column_config.TextColumn(width='small'),
+                    'Non-Null': st.column_config.NumberColumn(width='small'),
+                    'Unique': st.column_config.NumberColumn(width='small'),
                 })
-                st.dataframe(col_info, use_container_width=True)
                 
                 st.markdown("---")
                 
                 # Dataset metadata
                 st.markdown("#### Dataset Information")
-                ds_name = st.text_input("Dataset Name *", value=uploaded_file.name.rsplit('.', 1)[0])
-                ds_desc = st.text_area("Description", height=80)
-                
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    ds_dept = st.selectbox("Department", ["All", "MDS", "SGS", "BMS", "IT"])
-                with col_b:
-                    ds_tags = st.text_input("Tags (comma separated)", placeholder="sales, 2024, monthly")
+                # A form so editing the metadata doesn't rerun the page per field
+                with st.form("import_form"):
+                    ds_name = st.text_input("Dataset Name *", value=uploaded_file.name.rsplit('.', 1)[0])
+                    ds_desc = st.text_area("Description", height=80)
+                    
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        ds_dept = st.selectbox("Department", ["All"] + load_departments()['dept_id'].tolist())
+                    with col_b:
+                        ds_tags = st.text_input("Tags (comma separated)", placeholder="sales, 2024, monthly")
+                    
+                    submitted = st.form_submit_button("💾 Save to Workspace", type="primary")
                 
-                if st.button("💾 Save to Workspace", type="primary"):
+                if submitted:
                     if ds_name:
-                        dataset_id = uid("DS")
-                        
-                        # Save dataset metadata
-                        exec_sql("""
-                            INSERT INTO workspace_datasets 
-                            (dataset_id, dataset_name, description, source_type, dept_id, 
-                             row_count, column_count, columns_json, tags, created_by, created_ts, updated_ts)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (dataset_id, ds_name, ds_desc, "File Upload", 
-                              ds_dept if ds_dept != "All" else None,
-                              len(df), len(df.columns), json.dumps(df.columns.tolist()),
-                              ds_tags, current_user().get('username', 'system'),
-                              datetime.now().isoformat(), datetime.now().isoformat()))
+                        # One id for the dataset plus one per record
+                        ids = reserve_ids(len(df) + 1)
+                        dataset_id = uid("DS", ids)
+                        created_ts = datetime.now().isoformat()
+                        progress = st.progress(0.0, text="Saving records...")
                         
-                        # Save data records
-                        data_records = []
-                        for idx, row in df.iterrows():
-                            data_records.append({
-                                "data_id": uid("DATA"),
-                                "dataset_id": dataset_id,
-                                "row_index": idx,
-                                "data_json": json.dumps(row.to_dict(), default=str),
-                                "created_ts": datetime.now().isoformat()
-                            })
+                        # Save metadata and records in one transaction; records are
+                        # serialized and inserted chunk by chunk to bound peak memory
+                        with write_txn() as conn:
+                            conn.execute("""
+                                INSERT INTO workspace_datasets 
+                                (dataset_id, dataset_name, description, source_type, dept_id, 
+                                 row_count, column_count, columns_json, tags, created_by, created_ts, updated_ts,
+                                 content_hash)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """, (dataset_id, ds_name, ds_desc, "File Upload", 
+                                  ds_dept if ds_dept != "All" else None,
+                                  len(df), len(df.columns), json.dumps(df.columns.tolist()),
+                                  ds_tags, current_user().get('username', 'system'),
+                                  created_ts, created_ts,
+                                  content_hash))
+                            # Serialize the next chunk on a worker while this one is inserted
+                            with ThreadPoolExecutor(max_workers=1) as pool:
+                                pending = pool.submit(workspace_data_rows, df, dataset_id, 0, created_ts, ids)
+                                for start in range(0, len(df), IMPORT_CHUNK_ROWS):
+                                    rows = pending.result()
+                                    if start + IMPORT_CHUNK_ROWS < len(df):
+                                        pending = pool.submit(workspace_data_rows, df, dataset_id,
+                                                              start + IMPORT_CHUNK_ROWS, created_ts, ids)
+                                    insert_rows(conn, "workspace_data", WORKSPACE_DATA_COLUMNS, rows)
+                                    done = start + len(rows)
+                                    progress.progress(done / len(df), text=f"Saved {done:,} / {len(df):,} rows")
+                        progress.empty()
+                        invalidate_dataset_caches()
                         
-                        append_table("workspace_data", pd.DataFrame(data_records))
-                        
-                        st.success(f"✅ Dataset '{ds_name}' saved with {len(df)} records!")
-                        st.balloons()
+                        # Full rerun (not just this fragment) so the Catalog and the
+                        # dataset pickers in the other tabs show the new dataset
+                        st.session_state['import_saved_msg'] = f"✅ Dataset '{ds_name}' saved with {len(df)} records!"
+                        st.rerun()
                     else:
                         st.error("Please enter dataset name")
                         
             except Exception as e:
                 st.error(f"Error: {e}")
-    
-    with col2:
-        st.markdown("### 📋 Import Guidelines")
-        st.info("""
-        **Supported Formats:**
-        - Excel (.xlsx, .xls)
-        - CSV (.csv)
-        
-        **Best Practices:**
-        - Headers in first row
-        - Consistent data types per column
-        - Date format: YYYY-MM-DD
-        - No merged cells
-        
-        **Recommended Columns:**
-        - Date/Time column for trends
-        - Category columns for grouping
-        - Numeric columns for analysis
-        """)
-        
-        st.markdown("### 🏷️ Suggested Tags")
-        st.markdown("""
-        - `sales` - ข้อมูลยอดขาย
-        - `finance` - ข้อมูลการเงิน
-        - `hr` - ข้อมูลบุคลากร
-        - `operations` - ข้อมูลปฏิบัติการ
-        - `customers` - ข้อมูลลูกค้า
-        """)
 
+@st.fragment
 def render_category_manager():
     """Manage categories for data grouping"""
     st.markdown("### 🏷️ Category Manager")
@@ -898,29 +1326,29 @@ def render_category_manager():
     
     with col1:
         # Existing categories
-        categories = read_df("SELECT * FROM workspace_categories ORDER BY category_type, category_name")
+        categories = load_categories()
         
         if not categories.empty:
             st.markdown("#### Existing Categories")
             
             # Group by type
-            for cat_type in categories['category_type'].unique():
+            for cat_type, type_cats in categories.groupby('category_type', sort=False):
                 st.markdown(f"**{cat_type}**")
-                type_cats = categories[categories['category_type'] == cat_type]
                 
-                for _, cat in type_cats.iterrows():
+                for cat in type_cats.itertuples(index=False):
                     col_a, col_b, col_c = st.columns([3, 1, 1])
                     with col_a:
                         st.markdown(f"""
-                        <span style="color: {cat['color']};">{cat['icon']}</span> 
-                        **{cat['category_name']}** - {cat['description'] or 'No description'}
+                        <span style="color: {cat.color};">{cat.icon}</span> 
+                        **{cat.category_name}** - {cat.description or 'No description'}
                         """, unsafe_allow_html=True)
                     with col_b:
-                        if st.button("✏️", key=f"edit_cat_{cat['category_id']}"):
-                            st.session_state['edit_category'] = cat['category_id']
+                        if st.button("✏️", key=f"edit_cat_{cat.category_id}"):
+                            st.session_state['edit_category'] = cat.category_id
                     with col_c:
-                        if st.button("🗑️", key=f"del_cat_{cat['category_id']}"):
-                            exec_sql("DELETE FROM workspace_categories WHERE category_id = ?", (cat['category_id'],))
+                        if st.button("🗑️", key=f"del_cat_{cat.category_id}"):
+                            exec_sql("DELETE FROM workspace_categories WHERE category_id = ?", (cat.category_id,))
+                            load_categories.clear()
                             st.rerun()
                 
                 st.markdown("---")
@@ -932,11 +1360,11 @@ def render_category_manager():
         
         with st.form("new_category"):
             cat_name = st.text_input("Category Name *")
-            cat_type = st.selectbox("Type", ["Business", "Geographic", "Temporal", "Product", "Customer", "Other"])
+            cat_type = st.selectbox("Type", CATEGORY_TYPES)
             cat_desc = st.text_input("Description")
             cat_color = st.color_picker("Color", "#8b5cf6")
-            cat_icon = st.selectbox("Icon", ["📁", "🏷️", "📊", "🌍", "👥", "📦", "💰", "📅", "🎯", "⭐"])
-            cat_dept = st.selectbox("Department", [None, "MDS", "SGS", "BMS", "IT"])
+            cat_icon = st.selectbox("Icon", CATEGORY_ICONS)
+            cat_dept = st.selectbox("Department", [None] + load_departments()['dept_id'].tolist())
             
             if st.form_submit_button("Create Category", type="primary"):
                 if cat_name:
@@ -944,36 +1372,35 @@ def render_category_manager():
                         INSERT INTO workspace_categories 
                         (category_id, category_name, category_type, description, dept_id, color, icon, created_ts)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (uid("CAT"), cat_name, cat_type, cat_desc, cat_dept, cat_color, cat_icon, datetime.now().isoformat()))
+                    """, (uid("CAT", reserve_ids(1)), cat_name, cat_type, cat_desc, cat_dept, cat_color, cat_icon, datetime.now().isoformat()))
+                    load_categories.clear()
                     st.success(f"✅ Category '{cat_name}' created!")
                     st.rerun()
                 else:
                     st.error("Please enter category name")
 
+@st.fragment
 def render_data_explorer():
     """Explore and analyze data in datasets"""
     st.markdown("### 🔍 Data Explorer")
     
     # Select dataset
-    datasets = read_df("SELECT dataset_id, dataset_name FROM workspace_datasets ORDER BY dataset_name")
+    dataset_choices = load_dataset_choices()
     
-    if datasets.empty:
+    if not dataset_choices:
         st.info("ยังไม่มี Dataset กรุณา Import ข้อมูลก่อน")
         return
     
-    selected_ds = st.selectbox("Select Dataset", datasets['dataset_name'].tolist())
-    dataset_id = datasets.loc[datasets['dataset_name'] == selected_ds, 'dataset_id'].iloc[0]
+    dataset_id = st.selectbox("Select Dataset", list(dataset_choices), format_func=dataset_choices.get)
+    selected_ds = dataset_choices[dataset_id]
     
     # Load data
-    data_records = read_df("SELECT data_json FROM workspace_data WHERE dataset_id = ?", (dataset_id,))
+    df = load_dataset_df(dataset_id)
     
-    if data_records.empty:
+    if df.empty:
         st.warning("Dataset is empty")
         return
     
-    # Parse JSON to DataFrame
-    df = pd.DataFrame([json.loads(row['data_json']) for _, row in data_records.iterrows()])
-    
     st.markdown(f"**Total Records:** {len(df):,} | **Columns:** {len(df.columns)}")
     
     # Filters
@@ -998,43 +1425,53 @@ def render_data_explorer():
         # Aggregation
         numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
         agg_col = st.selectbox("Aggregate Column", ["None"] + numeric_cols)
-        agg_func = st.selectbox("Function", ["sum", "mean", "count", "min", "max"])
+        agg_func = st.selectbox("Function", AGG_FUNCS)
     
     st.markdown("---")
     
+    # Aggregate once; shared by the table and chart views
+    grouped_df = None
+    if group_col != "None" and agg_col != "None":
+        grouped_df = df.groupby(group_col)[agg_col].agg(agg_func).reset_index()
+        grouped_df.columns = [group_col, f'{agg_func}_{agg_col}']
+    
     # Display data
     tab1, tab2, tab3 = st.tabs(["📋 Table View", "📊 Chart View", "📈 Statistics"])
     
     with tab1:
-        if group_col != "None" and agg_col != "None":
-            grouped_df = df.groupby(group_col)[agg_col].agg(agg_func).reset_index()
-            grouped_df.columns = [group_col, f'{agg_func}_{agg_col}']
+        if grouped_df is not None:
             st.dataframe(grouped_df, use_container_width=True)
             
             # Export
             st.markdown(export_to_excel(grouped_df, f'grouped_{selected_ds}'), unsafe_allow_html=True)
         else:
-            st.dataframe(df, use_container_width=True)
+            st.dataframe(df.iloc[:MAX_TABLE_ROWS], use_container_width=True)
+            if len(df) > MAX_TABLE_ROWS:
+                st.caption(f"Showing first {MAX_TABLE_ROWS:,} of {len(df):,} rows; export for the full data")
             st.markdown(export_to_excel(df, selected_ds), unsafe_allow_html=True)
     
     with tab2:
-        if group_col != "None" and agg_col != "None":
-            grouped_df = df.groupby(group_col)[agg_col].agg(agg_func).reset_index()
-            grouped_df.columns = [group_col, f'{agg_func}_{agg_col}']
-            
+        if grouped_df is not None:
+            px = load_plotly_express()
             chart_type = st.radio("Chart Type", ["Bar", "Pie", "Line"], horizontal=True)
             
             if chart_type == "Bar":
-                fig = px.bar(grouped_df, x=group_col, y=f'{agg_func}_{agg_col}',
+                value_col = f'{agg_func}_{agg_col}'
+                plot_df = grouped_df.nlargest(MAX_BAR_CATEGORIES, value_col)
+                if len(grouped_df) > MAX_BAR_CATEGORIES:
+                    st.caption(f"Showing top {MAX_BAR_CATEGORIES} of {len(grouped_df)} {group_col} values")
+                fig = px.bar(plot_df, x=group_col, y=value_col,
                             color=group_col, title=f'{agg_func.title()} of {agg_col} by {group_col}')
+                fig.update_traces(marker_line_width=0)
             elif chart_type == "Pie":
                 fig = px.pie(grouped_df, values=f'{agg_func}_{agg_col}', names=group_col,
                             title=f'{agg_func.title()} of {agg_col} by {group_col}')
             else:
                 fig = px.line(grouped_df, x=group_col, y=f'{agg_func}_{agg_col}',
-                             title=f'{agg_func.title()} of {agg_col} by {group_col}')
+                             title=f'{agg_func.title()} of {agg_col} by {group_col}',
+                             render_mode='webgl')
             
-            fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8')
+            fig.update_layout(**CHART_THEME)
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("Select Group By and Aggregate columns to create chart")
@@ -1052,54 +1489,50 @@ def render_data_explorer():
         cat_df = df.select_dtypes(include=['object'])
         if not cat_df.empty:
             st.markdown("**Categorical Columns**")
+            # One value_counts pass per column gives unique/top/freq together
+            value_counts = {col: cat_df[col].value_counts() for col in cat_df.columns}
             cat_summary = pd.DataFrame({
                 'Column': cat_df.columns,
-                'Unique': [cat_df[col].nunique() for col in cat_df.columns],
-                'Top Value': [cat_df[col].mode()[0] if len(cat_df[col].mode()) > 0 else 'N/A' for col in cat_df.columns],
-                'Top Freq': [cat_df[col].value_counts().iloc[0] if len(cat_df[col].value_counts()) > 0 else 0 for col in cat_df.columns]
+                'Unique': [len(vc) for vc in value_counts.values()],
+                'Top Value': [vc.index[0] if len(vc) > 0 else 'N/A' for vc in value_counts.values()],
+                'Top Freq': [vc.iloc[0] if len(vc) > 0 else 0 for vc in value_counts.values()]
             })
             st.dataframe(cat_summary, use_container_width=True)
 
+@st.fragment
 def render_trend_analysis():
     """Trend Analysis by Category"""
     st.markdown("### 📊 Trend Analysis by Category")
     st.markdown("วิเคราะห์แนวโน้มข้อมูลตาม Category Grouping")
     
     # Select dataset
-    datasets = read_df("SELECT dataset_id, dataset_name FROM workspace_datasets ORDER BY dataset_name")
+    dataset_choices = load_dataset_choices()
     
-    if datasets.empty:
+    if not dataset_choices:
         st.info("ยังไม่มี Dataset กรุณา Import ข้อมูลก่อน")
         return
     
     col1, col2 = st.columns([1, 2])
     
     with col1:
-        selected_ds = st.selectbox("Select Dataset", datasets['dataset_name'].tolist(), key="trend_ds")
-        dataset_id = datasets.loc[datasets['dataset_name'] == selected_ds, 'dataset_id'].iloc[0]
+        dataset_id = st.selectbox("Select Dataset", list(dataset_choices), format_func=dataset_choices.get, key="trend_ds")
+        selected_ds = dataset_choices[dataset_id]
     
     # Load data
-    data_records = read_df("SELECT data_json FROM workspace_data WHERE dataset_id = ?", (dataset_id,))
+    df = load_dataset_df(dataset_id)
     
-    if data_records.empty:
+    if df.empty:
         st.warning("Dataset is empty")
         return
     
-    df = pd.DataFrame([json.loads(row['data_json']) for _, row in data_records.iterrows()])
-    
-    # Detect date column
-    date_cols = []
-    for col in df.columns:
-        try:
-            pd.to_datetime(df[col])
-            date_cols.append(col)
-        except:
-            pass
+    # Detect date column - only text columns can hold dates; detection and the
+    # aggregation below are cached per dataset/selection, so widget reruns
+    # (e.g. switching Sum/Average) don't re-parse every text column
+    date_cols = detect_date_columns(dataset_id)
     
     with col2:
         if date_cols:
             date_col = st.selectbox("Date Column", date_cols)
-            df[date_col] = pd.to_datetime(df[date_col])
         else:
             st.warning("No date column detected. Please ensure your data has a date column.")
             return
@@ -1123,31 +1556,20 @@ def render_trend_analysis():
     
     with col3:
         # Time granularity
-        granularity = st.selectbox("Time Granularity", ["Day", "Week", "Month", "Quarter"])
-    
-    # Prepare data
-    df_sorted = df.sort_values(date_col)
-    
-    if granularity == "Day":
-        df_sorted['period'] = df_sorted[date_col].dt.date
-    elif granularity == "Week":
-        df_sorted['period'] = df_sorted[date_col].dt.to_period('W').dt.start_time
-    elif granularity == "Month":
-        df_sorted['period'] = df_sorted[date_col].dt.to_period('M').dt.start_time
-    else:
-        df_sorted['period'] = df_sorted[date_col].dt.to_period('Q').dt.start_time
+        granularity = st.selectbox("Time Granularity", TIME_GRANULARITIES)
     
     # Aggregate
-    if group_category == "Overall":
-        trend_df = df_sorted.groupby('period')[metric_col].agg(['sum', 'mean', 'count']).reset_index()
-        trend_df.columns = ['period', 'total', 'average', 'count']
-    else:
-        trend_df = df_sorted.groupby(['period', group_category])[metric_col].agg(['sum', 'mean', 'count']).reset_index()
-        trend_df.columns = ['period', group_category, 'total', 'average', 'count']
+    trend_df = compute_trend(dataset_id, date_col, group_category, metric_col, granularity)
+    # Per-category totals feed both the Comparison tab and the Insights tab
+    comparison_df = None
+    if group_category != "Overall":
+        comparison_df = df.groupby(group_category)[metric_col].agg(['sum', 'mean', 'count']).reset_index()
+        comparison_df.columns = [group_category, 'Total', 'Average', 'Count']
     
     # Display charts
     st.markdown("---")
     
+    px = load_plotly_express()
     chart_tabs = st.tabs(["📈 Trend Line", "📊 Comparison", "📋 Data Table", "💡 Insights"])
     
     with chart_tabs[0]:
@@ -1159,18 +1581,22 @@ def render_trend_analysis():
         if group_category == "Overall":
             fig = px.line(trend_df, x='period', y=y_col,
                          title=f'{metric_type} of {metric_col} over Time',
-                         markers=True)
+                         markers=True, render_mode='webgl')
         else:
-            fig = px.line(trend_df, x='period', y=y_col, color=group_category,
+            plot_df = trend_df
+            if trend_df[group_category].nunique() > MAX_TREND_SERIES:
+                top_cats = trend_df.groupby(group_category)['total'].sum().nlargest(MAX_TREND_SERIES).index
+                plot_df = trend_df[trend_df[group_category].isin(top_cats)]
+                st.caption(f"Showing top {MAX_TREND_SERIES} {group_category} by total {metric_col}")
+            fig = px.line(plot_df, x='period', y=y_col, color=group_category,
                          title=f'{metric_type} of {metric_col} by {group_category}',
-                         markers=True)
+                         markers=True, render_mode='webgl')
         
         fig.update_layout(
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font_color='#94a3b8',
-            xaxis=dict(showgrid=True, gridcolor='rgba(71, 85, 105, 0.3)'),
-            yaxis=dict(showgrid=True, gridcolor='rgba(71, 85, 105, 0.3)'),
+            **CHART_THEME,
+            xaxis=GRID_AXIS,
+            yaxis=GRID_AXIS,
+            hovermode='closest',
             height=450
         )
         st.plotly_chart(fig, use_container_width=True)
@@ -1178,21 +1604,18 @@ def render_trend_analysis():
     with chart_tabs[1]:
         st.markdown("#### Category Comparison")
         
-        if group_category != "Overall":
+        if comparison_df is not None:
             # Comparison bar chart
-            comparison_df = df_sorted.groupby(group_category)[metric_col].agg(['sum', 'mean', 'count']).reset_index()
-            comparison_df.columns = [group_category, 'Total', 'Average', 'Count']
-            
             fig = px.bar(comparison_df, x=group_category, y='Total',
                         color=group_category,
                         title=f'Total {metric_col} by {group_category}')
-            fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8')
+            fig.update_layout(**CHART_THEME)
             st.plotly_chart(fig, use_container_width=True)
             
             # Pie chart
             fig2 = px.pie(comparison_df, values='Total', names=group_category,
                          title=f'Distribution of {metric_col} by {group_category}')
-            fig2.update_layout(paper_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8')
+            fig2.update_layout(**CHART_THEME)
             st.plotly_chart(fig2, use_container_width=True)
         else:
             st.info("Select a category to see comparison")
@@ -1217,12 +1640,9 @@ def render_trend_analysis():
         
         # Overall trend
         if len(trend_df) >= 2:
-            if group_category == "Overall":
-                first_val = trend_df['total'].iloc[0]
-                last_val = trend_df['total'].iloc[-1]
-            else:
-                first_val = trend_df.groupby('period')['total'].sum().iloc[0]
-                last_val = trend_df.groupby('period')['total'].sum().iloc[-1]
+            period_totals = trend_df['total'] if group_category == "Overall" else trend_df.groupby('period')['total'].sum()
+            first_val = period_totals.iloc[0]
+            last_val = period_totals.iloc[-1]
             
             if first_val > 0:
                 change = ((last_val - first_val) / first_val) * 100
@@ -1237,8 +1657,8 @@ def render_trend_analysis():
                                    "text": f"{metric_col} คงที่ (เปลี่ยนแปลง {change:.1f}%)"})
         
         # Category insights
-        if group_category != "Overall":
-            cat_totals = df_sorted.groupby(group_category)[metric_col].sum()
+        if comparison_df is not None:
+            cat_totals = comparison_df.set_index(group_category)['Total']
             top_cat = cat_totals.idxmax()
             top_val = cat_totals.max()
             total_val = cat_totals.sum()
@@ -1252,37 +1672,31 @@ def render_trend_analysis():
                            "text": f"{group_category} ที่มี {metric_col} ต่ำสุดคือ '{bottom_cat}' ({bottom_val:,.0f}, คิดเป็น {bottom_val/total_val*100:.1f}%)"})
         
         # Display insights
-        for insight in insights:
-            st.markdown(f"""
-            <div class="insight-card {insight['type']}">
-                {insight['icon']} {insight['text']}
-            </div>
-            """, unsafe_allow_html=True)
+        render_insight_cards(insights)
 
+@st.fragment
 def render_insights_generator():
     """Generate insights from data"""
     st.markdown("### 📈 Insights Generator")
     st.markdown("สร้างสารสนเทศจากข้อมูลอัตโนมัติ")
     
     # Select dataset
-    datasets = read_df("SELECT dataset_id, dataset_name FROM workspace_datasets ORDER BY dataset_name")
+    dataset_choices = load_dataset_choices()
     
-    if datasets.empty:
+    if not dataset_choices:
         st.info("ยังไม่มี Dataset กรุณา Import ข้อมูลก่อน")
         return
     
-    selected_ds = st.selectbox("Select Dataset", datasets['dataset_name'].tolist(), key="insight_ds")
-    dataset_id = datasets.loc[datasets['dataset_name'] == selected_ds, 'dataset_id'].iloc[0]
+    dataset_id = st.selectbox("Select Dataset", list(dataset_choices), format_func=dataset_choices.get, key="insight_ds")
+    selected_ds = dataset_choices[dataset_id]
     
     # Load data
-    data_records = read_df("SELECT data_json FROM workspace_data WHERE dataset_id = ?", (dataset_id,))
+    df = load_dataset_df(dataset_id)
     
-    if data_records.empty:
+    if df.empty:
         st.warning("Dataset is empty")
         return
     
-    df = pd.DataFrame([json.loads(row['data_json']) for _, row in data_records.iterrows()])
-    
     if st.button("🔮 Generate Insights", type="primary"):
         with st.spinner("Analyzing data..."):
             insights = []
@@ -1307,13 +1721,9 @@ def render_insights_generator():
             st.markdown("#### 💰 Numeric Analysis")
             numeric_df = df.select_dtypes(include=[np.number])
             
-            for col in numeric_df.columns[:5]:  # Top 5 numeric columns
-                total = numeric_df[col].sum()
-                avg = numeric_df[col].mean()
-                max_val = numeric_df[col].max()
-                min_val = numeric_df[col].min()
-                
-                st.markdown(f"""
+            # Top 5 numeric columns: stats in one vectorized pass, cards in one markdown element
+            stats = numeric_df.iloc[:, :5].agg(['sum', 'mean', 'max', 'min'])
+            st.markdown("".join(f"""
                 <div class="metric-card blue">
                     <h4 style="color: white; margin: 0;">{col}</h4>
                     <div style="display: grid; grid-template-columns: repeat(4, 1fr); gap: 1rem; margin-top: 0.5rem;">
@@ -1323,7 +1733,7 @@ def render_insights_generator():
                         <div><span style="color: #64748b;">Min</span><br><strong style="color: white;">{min_val:,.2f}</strong></div>
                     </div>
                 </div>
-                """, unsafe_allow_html=True)
+                """ for col, (total, avg, max_val, min_val) in stats.items()), unsafe_allow_html=True)
             
             st.markdown("---")
             
@@ -1334,10 +1744,10 @@ def render_insights_generator():
             cols = st.columns(min(3, len(cat_df.columns)))
             for i, col in enumerate(cat_df.columns[:3]):
                 with cols[i]:
+                    # Top-5 counts are tiny; a native chart avoids shipping a Plotly spec per column
                     value_counts = cat_df[col].value_counts().head(5)
-                    fig = px.pie(values=value_counts.values, names=value_counts.index, title=col)
-                    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', font_color='#94a3b8', height=300)
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.markdown(f"**{col}**")
+                    st.bar_chart(value_counts, height=300)
             
             st.markdown("---")
             
@@ -1349,26 +1759,27 @@ def render_insights_generator():
             # Find correlations if multiple numeric columns
             if len(numeric_cols) >= 2:
                 corr = numeric_df.corr()
-                for i in range(len(corr.columns)):
-                    for j in range(i+1, len(corr.columns)):
-                        if abs(corr.iloc[i, j]) > 0.7:
-                            findings.append({
-                                "type": "info",
-                                "icon": "🔗",
-                                "text": f"พบความสัมพันธ์สูงระหว่าง {corr.columns[i]} และ {corr.columns[j]} (r = {corr.iloc[i, j]:.2f})"
-                            })
+                corr_values = corr.to_numpy()
+                rows, cols_idx = np.triu_indices(len(corr.columns), k=1)
+                strong = np.abs(corr_values[rows, cols_idx]) > 0.7
+                for i, j in zip(rows[strong], cols_idx[strong]):
+                    findings.append({
+                        "type": "info",
+                        "icon": "🔗",
+                        "text": f"พบความสัมพันธ์สูงระหว่าง {corr.columns[i]} และ {corr.columns[j]} (r = {corr_values[i, j]:.2f})"
+                    })
             
             # Find outliers
             for col in numeric_cols[:3]:
-                q1 = numeric_df[col].quantile(0.25)
-                q3 = numeric_df[col].quantile(0.75)
+                q1, q3 = numeric_df[col].quantile([0.25, 0.75])
                 iqr = q3 - q1
-                outliers = numeric_df[(numeric_df[col] < q1 - 1.5*iqr) | (numeric_df[col] > q3 + 1.5*iqr)]
-                if len(outliers) > 0:
+                values = numeric_df[col].to_numpy()
+                n_outliers = int(((values < q1 - 1.5*iqr) | (values > q3 + 1.5*iqr)).sum())
+                if n_outliers > 0:
                     findings.append({
                         "type": "warning",
                         "icon": "⚠️",
-                        "text": f"พบข้อมูลผิดปกติ (Outliers) ใน {col}: {len(outliers)} รายการ ({len(outliers)/len(df)*100:.1f}%)"
+                        "text": f"พบข้อมูลผิดปกติ (Outliers) ใน {col}: {n_outliers} รายการ ({n_outliers/len(df)*100:.1f}%)"
                     })
             
             # Missing values
@@ -1387,12 +1798,7 @@ def render_insights_generator():
                     "text": "ข้อมูลมีคุณภาพดี ไม่พบปัญหาที่ต้องแก้ไข"
                 })
             
-            for finding in findings:
-                st.markdown(f"""
-                <div class="insight-card {finding['type']}">
-                    {finding['icon']} {finding['text']}
-                </div>
-                """, unsafe_allow_html=True)
+            render_insight_cards(findings)
 
 # ============================================================
 # DEPARTMENT DASHBOARDS
@@ -1404,37 +1810,38 @@ def render_dept_dashboard(dept_id, dept_name, color):
     today_id = to_date_id(date.today())
     thirty_days_ago = to_date_id(date.today() - timedelta(days=30))
     
-    kpi_df = read_df(f"""
-        SELECT k.*, d.kpi_name, dim.date
+    kpi_df = read_df("""
+        SELECT k.kpi_id, k.actual_value, k.target_value, d.kpi_name, dim.date
         FROM fact_kpi_data k
         JOIN dim_kpi d ON k.kpi_id = d.kpi_id
         JOIN dim_date dim ON k.date_id = dim.date_id
-        WHERE k.dept_id = '{dept_id}' AND k.date_id >= {thirty_days_ago}
+        WHERE k.dept_id = ? AND k.date_id >= ?
         ORDER BY k.date_id
-    """)
+    """, (dept_id, thirty_days_ago))
     
     if kpi_df.empty:
         st.info("No KPI data available")
         return
     
+    # Split into per-KPI frames in one grouping pass (first-seen order)
+    # instead of re-scanning with a mask per card/chart
+    kpi_groups = [kpi_data for _, kpi_data in kpi_df.groupby('kpi_id', sort=False)]
+    
     # KPI Cards
-    kpi_ids = kpi_df['kpi_id'].unique()
-    cols = st.columns(len(kpi_ids))
+    cols = st.columns(len(kpi_groups))
     
-    for i, kpi_id in enumerate(kpi_ids):
-        kpi_data = kpi_df[kpi_df['kpi_id'] == kpi_id]
-        if not kpi_data.empty:
-            latest = kpi_data.iloc[-1]
-            trend, change = calculate_trend(kpi_data['actual_value'])
-            
-            with cols[i]:
-                st.markdown(create_kpi_card(
-                    latest['kpi_name'],
-                    latest['actual_value'],
-                    latest['target_value'],
-                    trend_direction=trend,
-                    trend_value=change
-                ), unsafe_allow_html=True)
+    for i, kpi_data in enumerate(kpi_groups):
+        latest = kpi_data.iloc[-1]
+        trend, change = calculate_trend(kpi_data['actual_value'])
+        
+        with cols[i]:
+            st.markdown(create_kpi_card(
+                latest['kpi_name'],
+                latest['actual_value'],
+                latest['target_value'],
+                trend_direction=trend,
+                trend_value=change
+            ), unsafe_allow_html=True)
     
     st.markdown("---")
     
@@ -1442,53 +1849,51 @@ def render_dept_dashboard(dept_id, dept_name, color):
     col1, col2 = st.columns(2)
     
     with col1:
-        for kpi_id in kpi_ids[:1]:
-            kpi_data = kpi_df[kpi_df['kpi_id'] == kpi_id]
-            if not kpi_data.empty:
-                fig = create_trend_chart(kpi_data, 'date', 'actual_value', 
-                                        f"{kpi_data.iloc[0]['kpi_name']} Trend", color)
-                st.plotly_chart(fig, use_container_width=True)
+        for kpi_data in kpi_groups[:1]:
+            fig = create_trend_chart(kpi_data, 'date', 'actual_value', 
+                                    f"{kpi_data.iloc[0]['kpi_name']} Trend", color)
+            st.plotly_chart(fig, use_container_width=True)
     
     with col2:
-        if len(kpi_ids) > 1:
-            kpi_data = kpi_df[kpi_df['kpi_id'] == kpi_ids[1]]
-            if not kpi_data.empty:
-                latest = kpi_data.iloc[-1]
-                fig = create_gauge_chart(latest['actual_value'], latest['target_value'], 
-                                        kpi_data.iloc[0]['kpi_name'])
-                st.plotly_chart(fig, use_container_width=True)
+        if len(kpi_groups) > 1:
+            kpi_data = kpi_groups[1]
+            latest = kpi_data.iloc[-1]
+            fig = create_gauge_chart(latest['actual_value'], latest['target_value'], 
+                                    kpi_data.iloc[0]['kpi_name'])
+            st.plotly_chart(fig, use_container_width=True)
     
     # Insights
     st.markdown("### 💡 Insights")
     insights = generate_insights(dept_id)
-    for insight in insights[:5]:
-        st.markdown(f"""
-        <div class="insight-card {insight['type']}">
-            {insight['icon']} {insight['text']}
-        </div>
-        """, unsafe_allow_html=True)
+    render_insight_cards(insights[:5])
 
 def render_executive_dashboard():
     """Executive Dashboard"""
     st.markdown("## 📊 Executive Dashboard")
     
-    depts = read_df("SELECT * FROM dim_department")
+    depts = load_departments()
+    
+    # Latest-day achievement for every department in one grouped query
+    # (four rows - read straight into a dict, no DataFrame needed)
+    achievements = {row['dept_id']: row['achievement'] for row in fetch_rows("""
+        SELECT f.dept_id, AVG(f.actual_value / NULLIF(f.target_value, 0)) as achievement
+        FROM fact_kpi_data f
+        JOIN (SELECT dept_id, MAX(date_id) AS max_date_id FROM fact_kpi_data GROUP BY dept_id) m
+          ON f.dept_id = m.dept_id AND f.date_id = m.max_date_id
+        GROUP BY f.dept_id
+    """)}
     
     cols = st.columns(4)
-    for i, (_, dept) in enumerate(depts.iterrows()):
+    for i, dept in enumerate(depts.itertuples(index=False)):
         with cols[i]:
-            kpi_summary = read_df(f"""
-                SELECT AVG(actual_value / NULLIF(target_value, 0)) as achievement
-                FROM fact_kpi_data WHERE dept_id = '{dept['dept_id']}'
-                AND date_id = (SELECT MAX(date_id) FROM fact_kpi_data WHERE dept_id = '{dept['dept_id']}')
-            """)
-            achievement = kpi_summary.iloc[0]['achievement'] * 100 if not kpi_summary.empty and kpi_summary.iloc[0]['achievement'] else 0
+            achievement = achievements.get(dept.dept_id)
+            achievement = achievement * 100 if pd.notna(achievement) else 0
             status = "green" if achievement >= 100 else ("amber" if achievement >= 80 else "red")
             
             st.markdown(f"""
             <div class="metric-card {status}">
-                <h4 style="color: white;">{dept['dept_name']}</h4>
-                <div style="font-size: 2rem; font-weight: bold; color: {dept['color']};">{achievement:.0f}%</div>
+                <h4 style="color: white;">{dept.dept_name}</h4>
+                <div style="font-size: 2rem; font-weight: bold; color: {dept.color};">{achievement:.0f}%</div>
                 <small style="color: #64748b;">KPI Achievement</small>
             </div>
             """, unsafe_allow_html=True)
@@ -1498,12 +1903,7 @@ def render_executive_dashboard():
     # Insights
     st.markdown("### 💡 Organization Insights")
     insights = generate_insights()
-    for insight in insights[:6]:
-        st.markdown(f"""
-        <div class="insight-card {insight['type']}">
-            {insight['icon']} {insight['text']}
-        </div>
-        """, unsafe_allow_html=True)
+    render_insight_cards(insights[:6])
 
 def render_report_generator():
     """Report Generator"""
@@ -1512,16 +1912,17 @@ def render_report_generator():
     col1, col2 = st.columns(2)
     
     with col1:
-        report_type = st.selectbox("Report Type", ["KPI Scorecard", "Department Performance", "All Data"])
-        dept_filter = st.selectbox("Department", ["All", "MDS", "SGS", "BMS", "IT"])
+        report_type = st.selectbox("Report Type", REPORT_TYPES)
+        dept_filter = st.selectbox("Department", ["All"] + load_departments()['dept_id'].tolist())
     
     with col2:
         date_range = st.date_input("Date Range", [date.today() - timedelta(days=30), date.today()])
     
     if st.button("🚀 Generate", type="primary"):
-        dept_clause = f"AND dept_id = '{dept_filter}'" if dept_filter != "All" else ""
+        dept_clause = "AND f.dept_id = ?" if dept_filter != "All" else ""
         date_from = to_date_id(date_range[0])
         date_to = to_date_id(date_range[1])
+        params = (date_from, date_to, dept_filter) if dept_filter != "All" else (date_from, date_to)
         
         report_df = read_df(f"""
             SELECT d.dept_name, k.kpi_name, 
@@ -1530,9 +1931,9 @@ def render_report_generator():
             FROM fact_kpi_data f
             JOIN dim_department d ON f.dept_id = d.dept_id
             JOIN dim_kpi k ON f.kpi_id = k.kpi_id
-            WHERE f.date_id BETWEEN {date_from} AND {date_to} {dept_clause}
+            WHERE f.date_id BETWEEN ? AND ? {dept_clause}
             GROUP BY d.dept_name, k.kpi_name
-        """)
+        """, params)
         
         st.success("✅ Generated!")
         st.dataframe(report_df, use_container_width=True)
@@ -1553,20 +1954,28 @@ def render_admin():
     
     with tabs[0]:
         users = read_df("SELECT username, role, dept_id, is_enabled FROM dim_user")
-        st.dataframe(users, use_container_width=True)
+        st.dataframe(users, use_container_width=True, hide_index=True, column_config={
+            'username': st.column_config.TextColumn(width='medium'),
+            'role': st.column_config.TextColumn(width='small'),
+            'dept_id': st.column_config.TextColumn(width='small'),
+            'is_enabled': st.column_config.CheckboxColumn(width='small'),
+        })
         
         st.markdown("#### Add User")
-        col1, col2 = st.columns(2)
-        with col1:
-            new_user = st.text_input("Username")
-            new_pass = st.text_input("Password", type="password")
-        with col2:
-            new_role = st.selectbox("Role", ["Admin", "Executive", "DeptHead", "Staff"])
-            new_dept = st.selectbox("Department", [None, "MDS", "SGS", "BMS", "IT"])
+        # A form so typing doesn't rerun the page (and re-query the user table) per keystroke
+        with st.form("add_user_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                new_user = st.text_input("Username")
+                new_pass = st.text_input("Password", type="password")
+            with col2:
+                new_role = st.selectbox("Role", USER_ROLES)
+                new_dept = st.selectbox("Department", [None] + load_departments()['dept_id'].tolist())
+            submitted = st.form_submit_button("➕ Add")
         
-        if st.button("➕ Add"):
+        if submitted:
             if new_user and new_pass:
-                exec_sql("INSERT INTO dim_user VALUES (?, ?, ?, ?, ?, 1)",
+                exec_sql(INSERT_USER_SQL,
                         (new_user, sha256(new_pass), new_role, new_dept, None))
                 st.success("Added!")
                 st.rerun()
@@ -1599,7 +2008,7 @@ with st.sidebar:
     
     st.markdown("---")
     
-    users_exist = read_df("SELECT COUNT(*) as n FROM dim_user").iloc[0]['n'] > 0
+    users_exist = bool(fetch_rows("SELECT 1 FROM dim_user LIMIT 1"))
     
     if not is_logged_in():
         if not users_exist: